@@ -6,7 +6,7 @@ Created on Tue May 16 12:09:50 2017
 """
 
 import random
-from environment_trading import Agent, Environment
+from environment_trading import Action, Agent, Environment
 from planner_trading import RoutePlanner
 from simulator_trading import Simulator
 
@@ -14,6 +14,8 @@ class LearningAgent(Agent):
     """ An agent that learns to drive in the Smartcab world.
         This is the object you will be modifying. """ 
 
+    state_actions = (0, 2, 3)  # waypoint, left and oncoming in the state from build_state
+
     def __init__(self, env, learning=False, epsilon=1.0, alpha=0.9):
         super(LearningAgent, self).__init__(env)     # Set the agent in the evironment 
         self.planner = RoutePlanner(self.env, self)  # Create a route planner
@@ -81,7 +83,7 @@ class LearningAgent(Agent):
         # If it is not, create a new dictionary for that state
         #   Then, for each action available, set the initial Q-value to 0.0
         if self.learning and state not in self.Q:
-            self.Q[state] = {'left': 0, 'right':0, 'forward':0, None:0}
+            self.Q[state] = {Action.LEFT: 0, Action.RIGHT: 0, Action.FORWARD: 0, Action.NONE: 0}
 
         return 
 
@@ -136,9 +138,9 @@ class LearningAgent(Agent):
         return
         
 
-def run():
-    """ Driving function for running the simulation. 
-        Press ESC to close the simulation, or [SPACE] to pause the simulation. """
+def make_env():
+    """ Builds the environment and its primary learning agent for one simulation.
+        Returns the environment; the agent is available as env.primary_agent. """
 
     ##############
     # Create the environment
@@ -161,6 +163,14 @@ def run():
     # Flags:
     #   enforce_deadline - set to True to enforce a deadline metric
     env.set_primary_agent(agent, enforce_deadline=True)
+    return env
+
+
+def run():
+    """ Driving function for running the simulation. 
+        Press ESC to close the simulation, or [SPACE] to pause the simulation. """
+
+    env = make_env()
 
     ##############
     # Create the simulation
@@ -1,6 +1,22 @@
 import random
-import math
-from collections import OrderedDict
+import heapq
+
+uniform_random = random.random  # bound once; draws from the same seeded generator as random.random
+
+# Headings E, N, W, S: turning left steps one place forward through this cycle, turning right one place back
+headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+left_turns = dict(zip(headings, headings[1:] + headings[:1]))
+right_turns = dict(zip(headings, headings[-1:] + headings[:-1]))
+
+
+class Action(object):
+    """Integer codes for the actions an agent can take."""
+
+    NONE = 0
+    FORWARD = 1
+    LEFT = 2
+    RIGHT = 3
+    names = {NONE: None, FORWARD: 'forward', LEFT: 'left', RIGHT: 'right'}  # for display only
 
 
 class TrafficLight(object):
@@ -22,12 +38,88 @@ class TrafficLight(object):
             self.last_updated = t
 
 
+def resolve_action(action, green, heading, left, right, oncoming):
+    """ Assess whether an agent facing 'heading' at a light that is 'green' (or not)
+        can perform 'action', given the actions of the cars to its left, right and oncoming.
+        Returns the violation code and the heading the agent would have after moving. """
+
+    violation = 0
+
+    # Agent wants to drive forward:
+    if action == Action.FORWARD:
+        if not green: # Running red light
+            violation = 2 # Major violation
+            if left == Action.FORWARD or right == Action.FORWARD: # Cross traffic
+                violation = 4 # Accident
+
+    # Agent wants to drive left:
+    elif action == Action.LEFT:
+        if not green: # Running a red light
+            violation = 2 # Major violation
+            if left == Action.FORWARD or right == Action.FORWARD: # Cross traffic
+                violation = 4 # Accident
+            elif oncoming == Action.RIGHT: # Oncoming car turning right
+                violation = 4 # Accident
+        else: # Green light
+            if oncoming == Action.RIGHT or oncoming == Action.FORWARD: # Incoming traffic
+                violation = 3 # Accident
+            else: # Valid move!
+                heading = left_turns[heading]
+
+    # Agent wants to drive right:
+    elif action == Action.RIGHT:
+        if not green and left == Action.FORWARD: # Cross traffic
+            violation = 3 # Accident
+        else: # Valid move!
+            heading = right_turns[heading]
+
+    # Agent wants to perform no action:
+    elif action == Action.NONE:
+        if green and oncoming != Action.LEFT: # No oncoming traffic
+            violation = 1 # Minor violation
+
+    return violation, heading
+
+
+def make_wrap(bounds):
+    """ Returns a function that moves a location one step along a heading, wrapping around
+        the grid edges given by 'bounds' (min x, min y, max x, max y). The bounds are fixed
+        for the life of an environment, so they are bound into the function once. """
+
+    lo_x, lo_y = bounds[0], bounds[1]
+    span_x = bounds[2] - bounds[0] + 1
+    span_y = bounds[3] - bounds[1] + 1
+
+    def wrap(location, heading):
+        return ((location[0] + heading[0] - lo_x) % span_x + lo_x,
+                (location[1] + heading[1] - lo_y) % span_y + lo_y)  # wrap-around
+
+    return wrap
+
+
+class StepData(object):
+    """Metrics of the primary agent's latest step; fields are None until its first step."""
+
+    __slots__ = ('t', 'violation', 'state', 'deadline', 'waypoint', 'inputs', 'light', 'action', 'reward')
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, None)
+
+    def as_dict(self):
+        """ Returns the step data as a dictionary, for logging and display. """
+
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
 class Environment(object):
     """Environment within which all agents operate."""
 
-    valid_actions = [None, 'forward', 'left', 'right']
-    valid_inputs = {'light': TrafficLight.valid_states, 'oncoming': valid_actions, 'left': valid_actions, 'right': valid_actions}
-    valid_headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]  # E, N, W, S
+    valid_actions = [Action.NONE, Action.FORWARD, Action.LEFT, Action.RIGHT]
+    sensed_actions = [None, Action.FORWARD, Action.LEFT, Action.RIGHT]  # None = no car; other cars always report a waypoint
+    valid_inputs = {'light': TrafficLight.valid_states, 'oncoming': sensed_actions, 'left': sensed_actions, 'right': sensed_actions}
+    valid_headings = headings  # E, N, W, S
+    violation_rewards = (0, -5, -10, -20, -40)  # indexed by violation: none, minor, major, minor accident, major accident
     
     def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6)):
         self.verbose = verbose # If debug output should be given
@@ -35,26 +127,28 @@ class Environment(object):
         # Initialize simulation variables
         self.done = False
         self.t = 0
-        self.agent_states = OrderedDict()
-        self.step_data = {}
+        self.agent_states = {}
+        self.step_data = StepData()
         self.success = None
 
         # Road network
         self.grid_size = grid_size  # (columns, rows)
         self.bounds = (1, 2, self.grid_size[0], self.grid_size[1] + 1)
+        self.wrap = make_wrap(self.bounds)
         self.block_size = 100
         self.hang = 0.6
-        self.intersections = OrderedDict()
+        self.intersections = {}
         self.roads = []
         for x in range(self.bounds[0], self.bounds[2] + 1):
             for y in range(self.bounds[1], self.bounds[3] + 1):
                 self.intersections[(x, y)] = TrafficLight()  # A traffic light at each intersection
+        self.intersection_locations = tuple(self.intersections)  # fixed for the life of the environment
+        self.reset_traffic_lights()
 
         for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
+            for dx, dy in self.valid_headings:
+                b = (a[0] + dx, a[1] + dy)  # neighbours at L1 distance = 1
+                if b in self.intersections:
                     self.roads.append((a, b))
 
         # Add environment boundaries
@@ -76,15 +170,49 @@ class Environment(object):
             'initial_deadline': 0,  # given deadline (time steps) to start with
             'net_reward': 0.0,  # total reward earned in current trial
             'final_deadline': None,  # deadline value (time remaining) at the end
-            'actions': {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}, # violations and accidents
+            'actions': [0, 0, 0, 0, 0], # count of each violation code (0: none ... 4: major accident)
             'success': 0  # whether the agent reached the destination in time
         }
 
+    def reset_traffic_lights(self):
+        """ When called, reset_traffic_lights resets every traffic light and
+            schedules each one to switch after its first period. """
+
+        for traffic_light in self.intersections.values():
+            traffic_light.reset()
+        self.schedule_traffic_lights()
+
+    def schedule_traffic_lights(self):
+        """ When called, schedule_traffic_lights rebuilds the switching schedule
+            from the time each traffic light last switched. """
+
+        # Min-heap of (time step of the next switch, intersection)
+        self.light_schedule = [(traffic_light.last_updated + traffic_light.period, location) for location, traffic_light in self.intersections.items()]
+        heapq.heapify(self.light_schedule)
+        self.lights_updated_at = self.t
+
+    def update_traffic_lights(self):
+        """ When called, update_traffic_lights switches the traffic lights that are due at time t.
+            Same result as calling update(t) on every TrafficLight, but only the due lights are visited.
+            If t has gone back (a new trial), the schedule is rebuilt first, so lights reset
+            directly with TrafficLight.reset() are picked up too. """
+
+        if self.t < self.lights_updated_at:
+            self.schedule_traffic_lights()
+        self.lights_updated_at = self.t
+
+        schedule = self.light_schedule
+        while schedule[0][0] <= self.t:
+            location = heapq.heappop(schedule)[1]
+            traffic_light = self.intersections[location]
+            traffic_light.update(self.t)
+            heapq.heappush(schedule, (self.t + traffic_light.period, location))
+
     def create_agent(self, agent_class, *args, **kwargs):
         """ When called, create_agent creates an agent in the environment. """
 
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location': list(random.choice(self.intersections.keys())), 'heading': (0, 1)}
+        self.agent_states[agent] = {'location': list(random.choice(self.intersection_locations)), 'heading': (0, 1)}
         return agent
 
     def set_primary_agent(self, agent, enforce_deadline=False):
@@ -100,105 +228,64 @@ class Environment(object):
         """ Consider an action and perform the action if it is legal.
             Receive a reward for the agent based on traffic laws. """
 
-        assert agent in self.agent_states, "Unknown agent!"
+        state = self.agent_states.get(agent)
+        assert state is not None, "Unknown agent!"
         assert action in self.valid_actions, "Invalid action!"
 
-        state = self.agent_states[agent]
         location = state['location']
         heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+        green = self.intersections[location].state == (heading[1] != 0)  # NS open and heading N/S, or EW open and heading E/W
         inputs = self.sense(agent)
 
-        # Assess whether the agent can move based on the action chosen.
-        # Either the action is okay to perform, or falls under 4 types of violations:
-        # 0: Action okay
-        # 1: Minor traffic violation
-        # 2: Major traffic violation
-        # 3: Minor traffic violation causing an accident
-        # 4: Major traffic violation causing an accident
-        violation = 0
-
         # Reward scheme
         # First initialize reward uniformly random from [-1, 1]
-        reward = 2 * random.random() - 1
+        reward = 2 * uniform_random() - 1
 
-        # Create a penalty factor as a function of remaining deadline
-        # Scales reward multiplicatively from [0, 1]
-        fnc = self.t * 1.0 / (self.t + state['deadline']) if agent.primary_agent else 0.0
-        gradient = 10
-        
         # No penalty given to an agent that has no enforced deadline
         penalty = 0
 
-        # If the deadline is enforced, give a penalty based on time remaining
-        if self.enforce_deadline:
-            penalty = (math.pow(gradient, fnc) - 1) / (gradient - 1)
-
-        # Agent wants to drive forward:
-        if action == 'forward':
-            if light != 'green': # Running red light
-                violation = 2 # Major violation
-                if inputs['left'] == 'forward' or inputs['right'] == 'forward': # Cross traffic
-                    violation = 4 # Accident
-        
-        # Agent wants to drive left:
-        elif action == 'left':
-            if light != 'green': # Running a red light
-                violation = 2 # Major violation
-                if inputs['left'] == 'forward' or inputs['right'] == 'forward': # Cross traffic
-                    violation = 4 # Accident
-                elif inputs['oncoming'] == 'right': # Oncoming car turning right
-                    violation = 4 # Accident
-            else: # Green light
-                if inputs['oncoming'] == 'right' or inputs['oncoming'] == 'forward': # Incoming traffic
-                    violation = 3 # Accident
-                else: # Valid move!
-                    heading = (heading[1], -heading[0])
-
-        # Agent wants to drive right:
-        elif action == 'right':
-            if light != 'green' and inputs['left'] == 'forward': # Cross traffic
-                violation = 3 # Accident
-            else: # Valid move!
-                heading = (-heading[1], heading[0])
-
-        # Agent wants to perform no action:
-        elif action == None:
-            if light == 'green' and inputs['oncoming'] != 'left': # No oncoming traffic
-                violation = 1 # Minor violation
+        # If the deadline is enforced, give the primary agent a penalty based on time remaining
+        # (the penalty factor is 0 for every other agent, so it is not computed for them)
+        if self.enforce_deadline and agent.primary_agent:
+            # Create a penalty factor as a function of remaining deadline
+            # Scales reward multiplicatively from [0, 1]
+            fnc = self.t * 1.0 / (self.t + state['deadline'])
+            gradient = 10
+            penalty = (gradient ** fnc - 1) / (gradient - 1)
 
+        # Assess whether the agent can move based on the action chosen.
+        # Either the action is okay to perform, or falls under 4 types of violations:
+        # 0: Action okay
+        # 1: Minor traffic violation
+        # 2: Major traffic violation
+        # 3: Minor traffic violation causing an accident
+        # 4: Major traffic violation causing an accident
+        violation, heading = resolve_action(action, green, heading, inputs['left'], inputs['right'], inputs['oncoming'])
 
         # Did the agent attempt a valid move?
         if violation == 0:
             if action == agent.get_next_waypoint(): # Was it the correct action?
                 reward += 2 - penalty # (2, 1)
-            elif action == None and light != 'green': # Was the agent stuck at a red light?
+            elif action == Action.NONE and not green: # Was the agent stuck at a red light?
                 reward += 2 - penalty # (2, 1)
             else: # Valid but incorrect
                 reward += 1 - penalty # (1, 0)
 
             # Move the agent
-            if action is not None:
-                location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
-                            (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
+            if action != Action.NONE:
+                location = self.wrap(location, heading)
                 state['location'] = location
                 state['heading'] = heading
         # Agent attempted invalid move
         else:
-            if violation == 1: # Minor violation
-                reward += -5
-            elif violation == 2: # Major violation
-                reward += -10
-            elif violation == 3: # Minor accident
-                reward += -20
-            elif violation == 4: # Major accident
-                reward += -40
+            reward += self.violation_rewards[violation]
 
         # Did agent reach the goal after a valid move?
         if agent is self.primary_agent:
-            if state['location'] == state['destination']:
+            deadline = state['deadline']
+            if location == state['destination']:
                 # Did agent get to destination before deadline?
-                if state['deadline'] >= 0:
+                if deadline >= 0:
                     self.trial_data['success'] = 1
                 
                 # Stop the trial
@@ -209,31 +296,39 @@ class Environment(object):
                     print ("Environment.act(): Primary agent has reached destination!")
 
             if(self.verbose == True): # Debugging
-                print ("Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}".format(location, heading, action, reward))
+                print ("Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}".format(location, heading, Action.names[action], reward))
 
             # Update metrics
-            self.step_data['t'] = self.t
-            self.step_data['violation'] = violation
-            self.step_data['state'] = agent.get_state()
-            self.step_data['deadline'] = state['deadline']
-            self.step_data['waypoint'] = agent.get_next_waypoint()
-            self.step_data['inputs'] = inputs
-            self.step_data['light'] = light
-            self.step_data['action'] = action
-            self.step_data['reward'] = reward
+            step_data = self.step_data
+            step_data.t = self.t
+            step_data.violation = violation
+            step_data.state = agent.get_state()
+            step_data.deadline = deadline
+            step_data.waypoint = agent.get_next_waypoint()
+            step_data.inputs = inputs
+            step_data.light = 'green' if green else 'red'
+            step_data.action = action
+            step_data.reward = reward
             
-            self.trial_data['final_deadline'] = state['deadline'] - 1
+            self.trial_data['final_deadline'] = deadline - 1
             self.trial_data['net_reward'] += reward
             self.trial_data['actions'][violation] += 1
 
             if(self.verbose == True): # Debugging
-                print ("Environment.act(): Step data: {}".format(self.step_data))
+                data = self.step_data.as_dict()
+                data['state'] = agent.describe_state(data['state'])
+                data['action'] = Action.names[action]
+                data['waypoint'] = Action.names.get(data['waypoint'])
+                data['inputs'] = {key: value if key == 'light' else Action.names.get(value) for key, value in inputs.items()}
+                print ("Environment.act(): Step data: {}".format(data))
         return reward
 
 
 class Agent(object):
     """Base class for all agents."""
 
+    state_actions = ()  # positions of action codes in the agent's state tuple, named for display
+
     def __init__(self, env):
         self.env = env
         self.state = None
@@ -251,3 +346,11 @@ class Agent(object):
 
     def get_next_waypoint(self):
         return self.next_waypoint  
+
+    def describe_state(self, state):
+        """ Returns 'state' with the action codes at the positions in state_actions
+            replaced by their names, for display. Any other state is returned unchanged. """
+
+        if not isinstance(state, tuple):
+            return state
+        return tuple(Action.names.get(value, value) if i in self.state_actions else value for i, value in enumerate(state))
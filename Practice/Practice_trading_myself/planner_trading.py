@@ -6,6 +6,7 @@ Created on Tue May 16 12:09:12 2017
 """
 
 import random
+from environment_trading import Action
 
 class RoutePlanner(object):
     """ Complex route planner that is meant for a perpendicular grid network. """
@@ -41,38 +42,38 @@ class RoutePlanner(object):
         elif dx != 0:
 
             if dx * heading[0] > 0:  # Heading the correct East or West direction
-                return 'forward'
+                return Action.FORWARD
             elif dx * heading[0] < 0 and heading[0] < 0: # Heading West, destination East
                 if dy > 0: # Destination also to the South
-                    return 'left'
+                    return Action.LEFT
                 else:
-                    return 'right'
+                    return Action.RIGHT
             elif dx * heading[0] < 0 and heading[0] > 0: # Heading East, destination West
                 if dy < 0: # Destination also to the North
-                    return 'left'
+                    return Action.LEFT
                 else:
-                    return 'right'
+                    return Action.RIGHT
             elif dx * heading[1] > 0: # Heading North destination West; Heading South destination East
-                return 'left'
+                return Action.LEFT
             else:
-                return 'right'
+                return Action.RIGHT
 
         # Finally, check if destination is cardinally North or South of location
         elif dy != 0:
 
             if dy * heading[1] > 0:  # Heading the correct North or South direction
-                return 'forward'
+                return Action.FORWARD
             elif dy * heading[1] < 0 and heading[1] < 0: # Heading North, destination South
                 if dx < 0: # Destination also to the West
-                    return 'left'
+                    return Action.LEFT
                 else:
-                    return 'right'
+                    return Action.RIGHT
             elif dy * heading[1] < 0 and heading[1] > 0: # Heading South, destination North
                 if dx > 0: # Destination also to the East
-                    return 'left'
+                    return Action.LEFT
                 else:
-                    return 'right'
+                    return Action.RIGHT
             elif dy * heading[0] > 0: # Heading West destination North; Heading East destination South
-                return 'right'
+                return Action.RIGHT
             else:
-                return 'left'
\ No newline at end of file
+                return Action.LEFT
\ No newline at end of file
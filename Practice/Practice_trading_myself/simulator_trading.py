@@ -17,6 +17,7 @@ import time
 import random
 import importlib
 import csv
+from environment_trading import Action
 
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
@@ -55,9 +56,10 @@ class Simulator(object):
 
         self.quit = False
         self.start_time = None
-        self.current_time = 0.0
-        self.last_updated = 0.0
-        self.update_delay = update_delay  # duration between each step (in seconds)
+        self.current_time = 0  # time since the trial started (in nanoseconds)
+        self.last_updated = 0
+        self.update_delay = update_delay  # duration between each step (in seconds); GUI runs only, headless runs step without delay
+        self.update_delay_ns = int(update_delay * 1e9)
 
         self.display = display
         if self.display:
@@ -71,6 +73,7 @@ class Simulator(object):
                 self._ns = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "north-south.png")), (self.road_width, self.road_width))
 
                 self.frame_delay = max(1, int(self.update_delay * 1000))  # delay between GUI frames in ms (min: 1)
+                self.frame_delay_ns = self.frame_delay * 1000000
                 self.agent_sprite_size = (32, 32)
                 self.primary_agent_sprite_size = (42, 42)
                 self.agent_circle_radius = 20  # radius of circle, when using simple representation
@@ -106,14 +109,15 @@ class Simulator(object):
                     self.log_filename = os.path.join("logs", "sim_default-learning.csv")
                     self.table_filename = os.path.join("logs","sim_default-learning.txt")
 
-                self.table_file = open(self.table_filename, 'wb')
+                self.table_file = open(self.table_filename, 'w')
             else:
                 self.log_filename = os.path.join("logs", "sim_no-learning.csv")
             
             self.log_fields = ['trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
-            self.log_file = open(self.log_filename, 'wb')
+            self.log_file = open(self.log_filename, 'w', newline='')  # the csv module handles line endings
             self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
             self.log_writer.writeheader()
+            self._log_rows = []  # trial rows, written in one go when the simulation ends
 
     def run(self, tolerance=0.05, n_test=0):
         """ Run a simulation of the environment. 
@@ -132,46 +136,53 @@ class Simulator(object):
         testing = False
         trial = 1
 
-        while True:
+        try:
+            while True:
 
-            # Flip testing switch
-            if not testing:
-                if total_trials > 20: # Must complete minimum 20 training trials
-                    if a.learning:
-                        if a.epsilon < tolerance: # assumes epsilon decays to 0
+                # Flip testing switch
+                if not testing:
+                    if total_trials > 20: # Must complete minimum 20 training trials
+                        if a.learning:
+                            if a.epsilon < tolerance: # assumes epsilon decays to 0
+                                testing = True
+                                trial = 1
+                        else:
                             testing = True
                             trial = 1
-                    else:
-                        testing = True
-                        trial = 1
                         
-            # Break if we've reached the limit of testing trials
-            else:
-                if trial > n_test:
-                    break
-
-            # Pretty print to terminal
-            print ()
-            print ("/-------------------------")
-            if testing:
-                print ("| Testing trial {}".format(trial))
-            else:
-                print ("| Training trial {}".format(trial))
-
-            print ("\-------------------------")
-            print ()
-
-            self.env.reset(testing)
-            self.current_time = 0.0
-            self.last_updated = 0.0
-            self.start_time = time.time()
-            while True:
-                try:
-                    # Update current time
-                    self.current_time = time.time() - self.start_time
+                # Break if we've reached the limit of testing trials
+                else:
+                    if trial > n_test:
+                        break
 
-                    # Handle GUI events
-                    if self.display:
+                # Pretty print to terminal
+                print ()
+                print ("/-------------------------")
+                if testing:
+                    print ("| Testing trial {}".format(trial))
+                else:
+                    print ("| Training trial {}".format(trial))
+
+                print ("\\-------------------------")
+                print ()
+
+                self.env.reset(testing)
+                self.current_time = 0
+                self.last_updated = 0
+                self.start_time = time.monotonic_ns()
+                next_frame = self.start_time
+                while True:
+                    try:
+                        # Without a GUI there is nothing to pace or redraw, so step right away;
+                        # the per-step text status is only rendered alongside the GUI
+                        if not self.display:
+                            self.env.step()
+                            continue
+
+                        # Update current time
+                        self.current_time = time.monotonic_ns() - self.start_time
+
+                        # Handle GUI events
                         for event in self.pygame.event.get():
                             if event.type == self.pygame.QUIT:
                                 self.quit = True
@@ -184,52 +195,61 @@ class Simulator(object):
                         if self.paused:
                             self.pause()
 
-                    # Update environment
-                    if self.current_time - self.last_updated >= self.update_delay:
-                        self.env.step()
-                        self.last_updated = self.current_time
+                        # Update environment
+                        if self.current_time - self.last_updated >= self.update_delay_ns:
+                            self.env.step()
+                            self.last_updated = self.current_time
                     
-                    # Render text
-                    self.render_text(trial, testing)
+                        # Render text
+                        self.render_text(trial, testing)
 
-                    # Render GUI and sleep
-                    if self.display:
+                        # Render GUI and sleep until the next frame is due
+                        # Time spent stepping and rendering counts against the frame; after an overrun
+                        # (or a pause) frames continue from now instead of rushing to catch up
                         self.render(trial, testing)
-                        self.pygame.time.wait(self.frame_delay)
+                        now = time.monotonic_ns()
+                        next_frame = max(next_frame + self.frame_delay_ns, now)
+                        time.sleep((next_frame - now) / 1e9)
 
-                except KeyboardInterrupt:
-                    self.quit = True
-                finally:
-                    if self.quit or self.env.done:
-                        break
+                    except KeyboardInterrupt:
+                        self.quit = True
+                    finally:
+                        if self.quit or self.env.done:
+                            break
 
-            if self.quit:
-                break
+                if self.quit:
+                    break
 
-            # Collect metrics from trial
+                # Collect metrics from trial
+                if self.log_metrics:
+                    self._log_rows.append({
+                        'trial': trial,
+                        'testing': self.env.trial_data['testing'],
+                        'parameters': self.env.trial_data['parameters'],
+                        'initial_deadline': self.env.trial_data['initial_deadline'],
+                        'final_deadline': self.env.trial_data['final_deadline'],
+                        'net_reward': self.env.trial_data['net_reward'],
+                        'actions': dict(enumerate(self.env.trial_data['actions'])),  # as {violation: count}; a copy, the row is written later
+                        'success': self.env.trial_data['success']
+                    })
+
+                # Trial finished
+                if self.env.success == True:
+                    print ("\nTrial Completed!")
+                    print ("Agent reached the destination.")
+                else:
+                    print ("\nTrial Aborted!")
+                    print ("Agent did not reach the destination.")
+
+                # Increment
+                total_trials = total_trials + 1
+                trial = trial + 1
+
+        finally:
+            # Write the buffered trial rows even when the run is cut short by an error
             if self.log_metrics:
-                self.log_writer.writerow({
-                    'trial': trial,
-                    'testing': self.env.trial_data['testing'],
-                    'parameters': self.env.trial_data['parameters'],
-                    'initial_deadline': self.env.trial_data['initial_deadline'],
-                    'final_deadline': self.env.trial_data['final_deadline'],
-                    'net_reward': self.env.trial_data['net_reward'],
-                    'actions': self.env.trial_data['actions'],
-                    'success': self.env.trial_data['success']
-                })
-
-            # Trial finished
-            if self.env.success == True:
-                print ("\nTrial Completed!")
-                print ("Agent reached the destination.")
-            else:
-                print ("\nTrial Aborted!")
-                print ("Agent did not reach the destination.")
-
-            # Increment
-            total_trials = total_trials + 1
-            trial = trial + 1
+                self.log_writer.writerows(self._log_rows)
+                self.log_file.close()
 
         # Clean up
         if self.log_metrics:
@@ -239,17 +259,15 @@ class Simulator(object):
                 
                 f.write("/-----------------------------------------\n")
                 f.write("| State-action rewards from Q-Learning\n")
-                f.write("\-----------------------------------------\n\n")
+                f.write("\\-----------------------------------------\n\n")
 
                 for state in a.Q:
-                    f.write("{}\n".format(state))
-                    for action, reward in a.Q[state].iteritems():
-                        f.write(" -- {} : {:.2f}\n".format(action, reward))
+                    f.write("{}\n".format(a.describe_state(state)))
+                    for action, reward in a.Q[state].items():
+                        f.write(" -- {} : {:.2f}\n".format(Action.names[action], reward))
                     f.write("\n")  
                 self.table_file.close()
 
-            self.log_file.close()
-
         print ("\nSimulation ended. . . ")
 
         # Report final metrics